@@ -11,18 +11,30 @@ Features:
 - Uses PDF content for accurate feedback
 - Preserves original Aiken file
 - Shows progress with color-coded output
+- Sends feedback requests to Ollama concurrently, grouping questions
+  that share the same context into one request
+- Caches generated feedback so reruns only query the model for new questions
 
 Usage:
     python gift_converter.py codice_civ.pdf questions_improved.txt --output questions.gift
+
+Set OLLAMA_NUM_PARALLEL to the number of requests the Ollama server processes
+in parallel; the converter keeps at most that many requests in flight.
 """
 
+import json
+import asyncio
+import sqlite3
 import logging
 import argparse
+import threading
+import aiohttp
 import requests
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Awaitable, Callable
 from tqdm import tqdm
 from pdf_extractor import PDFExtractor
-from utils import chunk_text, load_questions
+from utils import load_questions, find_relevant_chunks, find_relevant_chunks_semantic, trim_context
+from utils import create_session, open_cache, cache_key, OLLAMA_NUM_PARALLEL, LETTERS, DEFAULT_MODEL
 import re
 
 # Configure logging with colors for better readability
@@ -39,6 +51,32 @@ YELLOW = "\033[93m"
 RED = "\033[91m"
 RESET = "\033[0m"
 
+# Bump when the feedback prompt changes, so cached feedback is regenerated
+PROMPT_VERSION = 3
+
+# Generation limits. Four feedback lines need far fewer tokens than the
+# model would otherwise produce, and the model stops at END_MARKER, which
+# the prompt asks for after the last feedback. NUM_CTX is the context
+# window requested for each question of a group; it must stay the same for
+# every request, since changing it makes Ollama reload the model.
+MAX_TOKENS_PER_QUESTION = 600
+NUM_CTX = 4096
+END_MARKER = "FINE_FEEDBACK"
+
+# How long Ollama keeps the model loaded after a request. Every request
+# sets it, since each request resets the model's keep-alive to its own value.
+KEEP_ALIVE = "1h"
+
+# Maximum length of the context pasted into a prompt (about 800 tokens).
+# Longer contexts are trimmed to the passages most relevant to the questions.
+MAX_CONTEXT_CHARS = 3200
+
+# Start of a feedback line in the model output, e.g. "Q1_FEEDBACK_A: ..."
+_FEEDBACK_RE = re.compile(r'^(?:Q(\d+)_)?FEEDBACK_([A-D]):\s*')
+
+# Article reference inside a feedback, e.g. "articolo 230-bis"
+_ARTICLE_RE = re.compile(r'articolo (\d+(?:-[a-z]+)?)', re.IGNORECASE)
+
 class GiftConverter:
     """
     A class that converts Aiken format questions to GIFT format with feedback.
@@ -46,34 +84,68 @@ class GiftConverter:
     This class takes questions in Aiken format and their corresponding context
     from a PDF, then uses the LLaMA model to generate appropriate feedback for
     each answer option, including relevant quotes and law references.
+    
+    The converter must be used as an async context manager, which owns the
+    HTTP session shared by all requests:
+    
+        async with GiftConverter() as converter:
+            gift = await converter.convert_to_gift(question, context)
     """
     
-    def __init__(self, model: str = "llama3.2", base_url: str = "http://localhost:11434"):
+    def __init__(self, model: str = DEFAULT_MODEL, base_url: str = "http://localhost:11434",
+                 cache_path: Optional[str] = "gift_cache.sqlite", group_size: int = 1):
         """
         Initialize the converter with model settings.
         
         Args:
-            model (str): Name of the Ollama model to use (default: llama3.2)
+            model (str): Name of the Ollama model to use
             base_url (str): Base URL for the Ollama API
+            cache_path (str, optional): SQLite file caching generated feedback,
+                                        or None to disable the cache
+            group_size (int): Maximum number of questions sent in one request
+                              by convert_group; the context window grows with it
         """
         self.model = model
         self.api_url = f"{base_url}/api/generate"
+        self.cache_path = cache_path
+        self.num_ctx = NUM_CTX * group_size
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.cache: Optional[sqlite3.Connection] = None
     
-    def generate_feedback(self, question: Dict[str, Any], context: str) -> Tuple[List[str], List[str]]:
+    async def __aenter__(self) -> "GiftConverter":
+        self.session = create_session()
+        if self.cache_path:
+            self.cache = open_cache(self.cache_path, "CREATE TABLE IF NOT EXISTS feedback (key BLOB PRIMARY KEY, correct TEXT, wrong TEXT)")
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+    
+    def _cache_key(self, question: Dict[str, Any], context: str) -> bytes:
+        """
+        Build the cache key for the feedback of a question.
+        
+        The key covers everything the feedback depends on: the question, its
+        context, the model and the prompt version.
         """
-        Generate feedback for each answer option.
+        return cache_key(json.dumps(question, sort_keys=True), context, self.model, str(PROMPT_VERSION))
+    
+    def _create_prompt(self, questions: List[Dict[str, Any]], context: str) -> str:
+        """
+        Create the feedback prompt for questions sharing the same context.
         
         Args:
-            question (Dict[str, Any]): Question in dictionary format with 'question',
-                                     'options', and 'correct' fields
-            context (str): Relevant text from the PDF for this question
+            questions (List[Dict[str, Any]]): Questions to generate feedback for
+            context (str): Relevant text from the PDF for these questions
             
         Returns:
-            Tuple[List[str], List[str]]: Lists of feedback for correct and incorrect answers
+            str: Formatted prompt
         """
-        prompt = f"""Analizza questa domanda del codice civile italiano e fornisci un feedback specifico per ogni risposta, usando SEMPRE citazioni dirette dal testo.
-
-Domanda:
+        question_blocks = "\n\n".join(f"""### Domanda {n}
 {question['question']}
 
 Opzioni:
@@ -82,7 +154,15 @@ B. {question['options'][1]}
 C. {question['options'][2]}
 D. {question['options'][3]}
 
-Risposta corretta: {question['correct']}
+Risposta corretta: {question['correct']}""" for n, question in enumerate(questions, 1))
+        
+        feedback_lines = "\n".join(
+            f"Q{n}_FEEDBACK_{letter}: [feedback per opzione {letter} della domanda {n} con citazione]"
+            for n in range(1, len(questions) + 1) for letter in 'ABCD')
+        
+        return f"""Analizza queste domande del codice civile italiano e fornisci un feedback specifico per ogni risposta di ogni domanda, usando SEMPRE citazioni dirette dal testo.
+
+{question_blocks}
 
 Contesto dal codice civile:
 {context}
@@ -103,95 +183,214 @@ ISTRUZIONI IMPORTANTI:
    "Consultare l'articolo [X] del Codice Civile per il testo completo"
 
 ESEMPIO DI FEEDBACK:
-FEEDBACK_A: Errato. L'articolo 230-bis stabilisce: "Il familiare che presta in modo continuativo la sua attività di lavoro nella famiglia o nell'impresa familiare ha diritto [...]"
-FEEDBACK_B: Corretto. L'articolo 230-bis stabilisce: "Salvo che sia configurabile un diverso rapporto, il familiare che presta in modo continuativo la sua attività di lavoro [...]"
+Q1_FEEDBACK_A: Errato. L'articolo 230-bis stabilisce: "Il familiare che presta in modo continuativo la sua attività di lavoro nella famiglia o nell'impresa familiare ha diritto [...]"
+Q1_FEEDBACK_B: Corretto. L'articolo 230-bis stabilisce: "Salvo che sia configurabile un diverso rapporto, il familiare che presta in modo continuativo la sua attività di lavoro [...]"
+
+Fornisci il feedback per ogni opzione di ogni domanda, poi scrivi {END_MARKER} su una riga a parte:
+{feedback_lines}
+{END_MARKER}"""
 
-Fornisci il feedback per ogni opzione:
-FEEDBACK_A: [feedback per opzione A con citazione]
-FEEDBACK_B: [feedback per opzione B con citazione]
-FEEDBACK_C: [feedback per opzione C con citazione]
-FEEDBACK_D: [feedback per opzione D con citazione]"""
+    async def generate_feedback(self, questions: List[Dict[str, Any]], context: str) -> List[Tuple[List[str], List[str]]]:
+        """
+        Generate feedback for each answer option of questions sharing the same context.
+        
+        Questions missing from the cache are sent to the model in a single
+        prompt, so the instructions and the context are processed only once.
+        The prompt gets the context trimmed to the passages most relevant to
+        these questions, while the cache is keyed by the full context, so a
+        question's cache entry does not depend on the questions grouped with it.
+        
+        Args:
+            questions (List[Dict[str, Any]]): Questions in dictionary format with 'question',
+                                              'options', and 'correct' fields
+            context (str): Relevant text from the PDF for these questions
+            
+        Returns:
+            List[Tuple[List[str], List[str]]]: For each question, lists of feedback
+                                               for correct and incorrect answers
+        """
+        results: List[Optional[Tuple[List[str], List[str]]]] = [None] * len(questions)
+        cache_keys = []
+        if self.cache:
+            cache_keys = [self._cache_key(question, context) for question in questions]
+            for i, key in enumerate(cache_keys):
+                row = self.cache.execute("SELECT correct, wrong FROM feedback WHERE key = ?", (key,)).fetchone()
+                if row:
+                    results[i] = (json.loads(row[0]), json.loads(row[1]))
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        
+        query = ' '.join(
+            ' '.join([questions[i]['question'], *questions[i]['options']]) for i in pending
+        )
+        prompt = self._create_prompt([questions[i] for i in pending],
+                                     trim_context(query, context, MAX_CONTEXT_CHARS))
+        feedbacks = [['', '', '', ''] for _ in pending]
 
         try:
-            # Send request to Ollama API
-            response = requests.post(
+            current_feedback = None
+            buffer = ''
+            complete = False
+            
+            # Stream the response from Ollama API, parsing feedback lines as they
+            # arrive. Once all feedbacks are complete the connection is closed,
+            # which stops the model from generating any trailing text.
+            async with self.session.post(
                 self.api_url,
                 json={
                     "model": self.model,
                     "prompt": prompt,
-                    "stream": False,
+                    "stream": True,
+                    "keep_alive": KEEP_ALIVE,
                     "options": {
-                        "temperature": 0.1
+                        "temperature": 0.1,
+                        "num_predict": MAX_TOKENS_PER_QUESTION * len(pending),
+                        "num_ctx": self.num_ctx,
+                        "stop": [END_MARKER]
                     }
                 }
-            )
-            response.raise_for_status()
-            result = response.json()['response'].strip()
-            
-            # Parse feedback for each option
-            feedbacks = {'A': '', 'B': '', 'C': '', 'D': ''}
-            current_feedback = None
-            
-            for line in result.split('\n'):
-                line = line.strip()
-                if line.startswith('FEEDBACK_'):
-                    current_feedback = line[9:10]  # Get the option letter
-                    line = line[12:].strip()  # Remove "FEEDBACK_X: "
-                
-                if current_feedback and line:
-                    if feedbacks[current_feedback]:
-                        feedbacks[current_feedback] += ' ' + line
-                    else:
-                        feedbacks[current_feedback] = line
-            
-            # Validate feedbacks contain citations
-            for letter, feedback in feedbacks.items():
-                if not ('"' in feedback or "'" in feedback):
-                    article_match = re.search(r'articolo (\d+(?:-[a-z]+)?)', feedback, re.IGNORECASE)
-                    if article_match:
-                        article = article_match.group(1)
-                        feedbacks[letter] = f"Consultare l'articolo {article} del Codice Civile per il testo completo"
-            
-            # Separate correct and incorrect feedbacks
-            correct_letter = question['correct']
-            correct_feedback = [feedbacks[correct_letter]] if feedbacks[correct_letter] else ["Consultare il Codice Civile per il testo completo"]
-            
-            wrong_feedback = []
-            for letter in ['A', 'B', 'C', 'D']:
-                if letter != correct_letter and feedbacks[letter]:
-                    wrong_feedback.append(feedbacks[letter])
-            
-            if not wrong_feedback:
-                wrong_feedback = ["Consultare il Codice Civile per il testo completo"]
+            ) as response:
+                response.raise_for_status()
+                async for raw_line in response.content:
+                    if not raw_line.strip():
+                        continue
+                    chunk = json.loads(raw_line)
+                    if 'error' in chunk:
+                        raise RuntimeError(chunk['error'])
+                    
+                    buffer += chunk.get('response', '')
+                    *lines, buffer = buffer.split('\n')
+                    for line in lines:
+                        current_feedback = self._add_feedback_line(line, feedbacks, current_feedback)
+                    
+                    if all(all(question_feedbacks) for question_feedbacks in feedbacks):
+                        complete = True
+                        response.close()
+                        break
+                    if chunk.get('done'):
+                        break
             
-            return correct_feedback, wrong_feedback
+            if not complete:
+                self._add_feedback_line(buffer, feedbacks, current_feedback)
                     
         except Exception as e:
+            # Questions without feedback get the default feedback below
             logger.error(f"{RED}Error generating feedback: {str(e)}{RESET}")
-            return (["Consultare il Codice Civile per il testo completo"], 
-                   ["Consultare il Codice Civile per il testo completo"])
+        
+        # Split the feedback of each question on its own, outside the request,
+        # so one malformed question cannot discard the others' feedback.
+        # Only complete feedback is cached: a failed request, a refusal or a
+        # response cut short leaves some options without feedback.
+        for i, question_feedbacks in zip(pending, feedbacks):
+            results[i] = self._split_feedback(questions[i], question_feedbacks)
+            if self.cache and all(question_feedbacks):
+                self.cache.execute("INSERT OR REPLACE INTO feedback VALUES (?, ?, ?)",
+                                   (cache_keys[i], json.dumps(results[i][0]), json.dumps(results[i][1])))
+        if self.cache:
+            self.cache.commit()
+        
+        return results
 
-    def convert_to_gift(self, question: Dict[str, Any], context: str) -> str:
+    @staticmethod
+    def _add_feedback_line(line: str, feedbacks: List[List[str]],
+                           current_feedback: Optional[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
         """
-        Convert a single question from Aiken to GIFT format with feedback.
+        Add one line of model output to the feedback it belongs to.
+        
+        Args:
+            line (str): Line of model output
+            feedbacks (List[List[str]]): Feedback text by option index for
+                                         each question, updated in place
+            current_feedback (Optional[Tuple[int, int]]): Question index and option
+                                                          index of the feedback being read
+            
+        Returns:
+            Optional[Tuple[int, int]]: Question index and option index of the
+                                       feedback being read after this line
+        """
+        line = line.strip()
+        if line.startswith(END_MARKER):
+            return None
+        match = _FEEDBACK_RE.match(line)
+        if match:
+            number, letter = match.groups()
+            if number is None:
+                # Unnumbered feedback belongs to the question being read
+                index = current_feedback[0] if current_feedback else 0
+            else:
+                index = int(number) - 1
+            current_feedback = (index, ord(letter) - 65) if 0 <= index < len(feedbacks) else None
+            line = line[match.end():]
+        
+        if current_feedback and line:
+            index, option = current_feedback
+            if feedbacks[index][option]:
+                feedbacks[index][option] += ' ' + line
+            else:
+                feedbacks[index][option] = line
+        return current_feedback
+
+    @staticmethod
+    def _split_feedback(question: Dict[str, Any], feedbacks: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Validate the feedback of a question and split it by correct and incorrect answers.
+        
+        A question without a valid answer letter (e.g. loaded from an Aiken
+        block without ANSWER line) has no correct answer, so all of its
+        feedback goes to the incorrect answers.
+        
+        Args:
+            question (Dict[str, Any]): Question the feedback belongs to
+            feedbacks (List[str]): Feedback text by option index
+            
+        Returns:
+            Tuple[List[str], List[str]]: Lists of feedback for correct and incorrect answers
+        """
+        # Validate feedbacks contain citations
+        for i, feedback in enumerate(feedbacks):
+            if not ('"' in feedback or "'" in feedback):
+                article_match = _ARTICLE_RE.search(feedback)
+                if article_match:
+                    article = article_match.group(1)
+                    feedbacks[i] = f"Consultare l'articolo {article} del Codice Civile per il testo completo"
+        
+        # Separate correct and incorrect feedbacks
+        correct_index = LETTERS.index(question['correct']) if question.get('correct') in LETTERS[:4] else None
+        if correct_index is not None and feedbacks[correct_index]:
+            correct_feedback = [feedbacks[correct_index]]
+        else:
+            correct_feedback = ["Consultare il Codice Civile per il testo completo"]
+        
+        wrong_feedback = [feedback for i, feedback in enumerate(feedbacks)
+                          if i != correct_index and feedback]
+        
+        if not wrong_feedback:
+            wrong_feedback = ["Consultare il Codice Civile per il testo completo"]
+        
+        return correct_feedback, wrong_feedback
+
+    @staticmethod
+    def _format_gift(question: Dict[str, Any], correct_feedback: List[str], wrong_feedback: List[str]) -> str:
+        """
+        Format a question and its feedback in GIFT format.
         
         Args:
             question (Dict[str, Any]): Question in Aiken format
-            context (str): Relevant text from PDF
+            correct_feedback (List[str]): Feedback for the correct answer
+            wrong_feedback (List[str]): Feedback for the incorrect answers
             
         Returns:
             str: Question in GIFT format with feedback
         """
-        # Get feedback for answers
-        correct_feedback, wrong_feedback = self.generate_feedback(question, context)
-        
         # Start building GIFT format
         gift = f"::Q:: {question['question']}\n{{"
         
         # Add each option with appropriate feedback
         wrong_idx = 0
         for i, option in enumerate(question['options']):
-            if chr(65 + i) == question['correct']:
+            if LETTERS[i] == question['correct']:
                 feedback = correct_feedback[0] if correct_feedback else "Consultare il Codice Civile per il testo completo"
                 gift += f" ={option} # {feedback}"
             else:
@@ -202,53 +401,186 @@ FEEDBACK_D: [feedback per opzione D con citazione]"""
         gift += " }\n\n"
         return gift
 
-def save_gift_questions(questions: List[str], output_file: str, batch_size: int = 500, show_gift: bool = False):
+    async def convert_group(self, questions: List[Dict[str, Any]], context: str) -> List[str]:
+        """
+        Convert questions sharing the same context from Aiken to GIFT format,
+        generating their feedback with a single request.
+        
+        Args:
+            questions (List[Dict[str, Any]]): Questions in Aiken format
+            context (str): Relevant text from PDF
+            
+        Returns:
+            List[str]: Questions in GIFT format with feedback
+        """
+        feedback = await self.generate_feedback(questions, context)
+        return [self._format_gift(question, correct_feedback, wrong_feedback)
+                for question, (correct_feedback, wrong_feedback) in zip(questions, feedback)]
+
+    async def convert_to_gift(self, question: Dict[str, Any], context: str) -> str:
+        """
+        Convert a single question from Aiken to GIFT format with feedback.
+        
+        Args:
+            question (Dict[str, Any]): Question in Aiken format
+            context (str): Relevant text from PDF
+            
+        Returns:
+            str: Question in GIFT format with feedback
+        """
+        return (await self.convert_group([question], context))[0]
+
+async def _gather_bounded(tasks: Iterable[Awaitable], limit: int) -> List[Any]:
     """
-    Save questions in GIFT format, creating a new file every batch_size questions.
+    Await tasks concurrently, keeping at most `limit` of them running at once.
     
     Args:
-        questions (List[str]): List of questions in GIFT format
-        output_file (str): Base path for output files. Will append _1, _2, etc.
-                          for each batch of batch_size questions
-        batch_size (int): Number of questions per output file (default: 500)
-        show_gift (bool): If True, display converted questions in output
+        tasks (Iterable[Awaitable]): Coroutines to run
+        limit (int): Maximum number of coroutines running at the same time
+        
+    Returns:
+        List[Any]: Results in the same order as `tasks`
+    """
+    semaphore = asyncio.Semaphore(limit)
+    
+    async def run(task: Awaitable) -> Any:
+        async with semaphore:
+            return await task
+    
+    return await asyncio.gather(*(run(task) for task in tasks))
+
+def preload_model(model: str, base_url: str = "http://localhost:11434", keep_alive: str = KEEP_ALIVE,
+                  num_ctx: int = NUM_CTX):
     """
-    logger.info(f"\n{BLUE}Saving GIFT format questions...{RESET}")
+    Ask Ollama to load a model into memory without generating anything.
     
-    # Split questions into batches
-    num_batches = (len(questions) + batch_size - 1) // batch_size
+    The model must be loaded with the same context window as the feedback
+    requests, so the first of them does not make Ollama reload it.
+    Failures are only logged: the first real request then loads the model.
     
-    # Get base filename without extension
-    base_name = output_file.rsplit('.', 1)[0]
-    extension = output_file.rsplit('.', 1)[1] if '.' in output_file else 'gift'
+    Args:
+        model (str): Name of the Ollama model to load
+        base_url (str): Base URL for the Ollama API
+        keep_alive (str): How long Ollama keeps the model loaded after the last request
+        num_ctx (int): Context window of the feedback requests
+    """
+    try:
+        response = requests.post(f"{base_url}/api/generate",
+                                 json={"model": model, "keep_alive": keep_alive,
+                                       "options": {"num_ctx": num_ctx}}, timeout=600)
+        response.raise_for_status()
+        logger.debug("Model %s loaded", model)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"{YELLOW}Could not preload model {model}: {str(e)}{RESET}")
+
+async def convert_questions(pairs: List[Tuple[Dict[str, Any], str]], on_converted: Callable[[int, str], None],
+                            progress: Optional[tqdm] = None, cache_path: Optional[str] = "gift_cache.sqlite",
+                            group_size: int = 4, model: str = DEFAULT_MODEL):
+    """
+    Convert questions to GIFT format, sending up to OLLAMA_NUM_PARALLEL requests at once.
     
-    for batch_num in range(num_batches):
-        start_idx = batch_num * batch_size
-        end_idx = min((batch_num + 1) * batch_size, len(questions))
+    Questions sharing the same context are sent together, up to `group_size`
+    per request, so the model processes each context once per group.
+    Converted questions are handed to `on_converted` in the same order as
+    `pairs` as soon as they are available, instead of being collected.
+    
+    Args:
+        pairs (List[Tuple[Dict[str, Any], str]]): (question, context) pairs to convert
+        on_converted (Callable[[int, str], None]): Called with the index and GIFT
+                                                   text of each converted question
+        progress (tqdm, optional): Progress bar updated as questions complete
+        cache_path (str, optional): SQLite feedback cache file, or None to disable it
+        group_size (int): Maximum number of questions per request
+        model (str): Name of the Ollama model to use
+    """
+    # Group question indices by context
+    by_context: Dict[str, List[int]] = {}
+    for i, (_, context) in enumerate(pairs):
+        by_context.setdefault(context, []).append(i)
+    groups = [(indices[start:start + group_size], context)
+              for context, indices in by_context.items()
+              for start in range(0, len(indices), group_size)]
+    
+    # Questions converted ahead of an earlier one, waiting for their turn
+    converted: Dict[int, str] = {}
+    next_index = 0
+    
+    async with GiftConverter(model=model, cache_path=cache_path, group_size=group_size) as converter:
+        async def convert(indices: List[int], context: str):
+            nonlocal next_index
+            gifts = await converter.convert_group([pairs[i][0] for i in indices], context)
+            converted.update(zip(indices, gifts))
+            if progress is not None:
+                progress.update(len(indices))
+            while next_index in converted:
+                on_converted(next_index, converted.pop(next_index))
+                next_index += 1
         
-        # Create batch filename
-        if num_batches > 1:
-            batch_file = f"{base_name}_{batch_num + 1}.{extension}"
-        else:
-            batch_file = output_file
-            
-        # Get questions for this batch
-        batch_questions = questions[start_idx:end_idx]
+        await _gather_bounded([convert(indices, context) for indices, context in groups], OLLAMA_NUM_PARALLEL)
+
+class GiftWriter:
+    """
+    Writes GIFT format questions to disk as they are produced, starting a new
+    file every batch_size questions.
+    
+    With more than batch_size questions in total, files are named after the
+    output file with _1, _2, etc. appended; otherwise the output file is used
+    as is.
+    """
+    
+    def __init__(self, output_file: str, total: int, batch_size: int = 500):
+        """
+        Initialize the writer.
+        
+        Args:
+            output_file (str): Base path for output files
+            total (int): Total number of questions that will be written
+            batch_size (int): Number of questions per output file (default: 500)
+        """
+        self.output_file = output_file
+        self.batch_size = batch_size
+        self.num_batches = (total + batch_size - 1) // batch_size
+        self.written = 0
+        self.file = None
+        self.batch_file = None
         
-        # Save this batch
-        with open(batch_file, 'w', encoding='utf-8') as f:
-            f.writelines(batch_questions)
+        # Get base filename without extension
+        self.base_name = output_file.rsplit('.', 1)[0]
+        self.extension = output_file.rsplit('.', 1)[1] if '.' in output_file else 'gift'
+    
+    def __enter__(self) -> "GiftWriter":
+        logger.info(f"\n{BLUE}Saving GIFT format questions to {self.output_file}...{RESET}")
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._close_batch()
+    
+    def write(self, gift_question: str):
+        """
+        Write one question, opening the next batch file when the current one is full.
         
-        logger.info(f"{GREEN}Saved questions {start_idx + 1}-{end_idx} to {batch_file}{RESET}")
+        Args:
+            gift_question (str): Question in GIFT format
+        """
+        if self.written % self.batch_size == 0:
+            self._close_batch()
+            batch_num = self.written // self.batch_size + 1
+            if self.num_batches > 1:
+                self.batch_file = f"{self.base_name}_{batch_num}.{self.extension}"
+            else:
+                self.batch_file = self.output_file
+            self.file = open(self.batch_file, 'w', encoding='utf-8')
         
-        # Show converted questions if requested
-        if show_gift:
-            logger.info(f"\n{BLUE}Questions in {batch_file}:{RESET}")
-            for i, question in enumerate(batch_questions, start=start_idx + 1):
-                logger.info(f"\n{YELLOW}Question {i}:{RESET}")
-                logger.info(question.strip())
+        self.file.write(gift_question)
+        self.written += 1
     
-    logger.info(f"\n{GREEN}Completed saving all {len(questions)} questions across {num_batches} files{RESET}")
+    def _close_batch(self):
+        """Close the current batch file, if any."""
+        if self.file:
+            self.file.close()
+            self.file = None
+            start_idx = (self.written - 1) // self.batch_size * self.batch_size
+            logger.info(f"{GREEN}Saved questions {start_idx + 1}-{self.written} to {self.batch_file}{RESET}")
 
 def main():
     """
@@ -261,7 +593,7 @@ def main():
        - Find most relevant context from PDF
        - Generate feedback based on context
        - Convert to GIFT format with feedback
-    4. Save GIFT format questions to new files (batch_size questions per file)
+       - Save it to the current output file (batch_size questions per file)
     """
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Convert Aiken questions to GIFT format with feedback')
@@ -271,10 +603,21 @@ def main():
                       help='Size of text chunks to process (default: 8000)')
     parser.add_argument('--output', default='questions.gift',
                       help='Output file for GIFT format questions (default: questions.gift). Will append _1, _2, etc. if more than batch_size questions')
+    parser.add_argument('--model', default=DEFAULT_MODEL,
+                      help=f'Ollama model generating the feedback (default: {DEFAULT_MODEL})')
     parser.add_argument('--batch-size', type=int, default=500,
                       help='Number of questions per output file (default: 500)')
     parser.add_argument('--show-gift', action='store_true',
                       help='Show converted questions in output')
+    parser.add_argument('--group-size', type=int, default=4,
+                      help='Maximum number of questions sharing a context sent in one request (default: 4)')
+    parser.add_argument('--embed-model',
+                      help='Ollama embedding model used to find the context of each question, '
+                           'e.g. nomic-embed-text (default: TF-IDF keyword matching)')
+    parser.add_argument('--cache-file', default='gift_cache.sqlite',
+                      help='SQLite file caching generated feedback between runs (default: gift_cache.sqlite)')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Always regenerate feedback and embeddings instead of using the cache')
     parser.add_argument('--debug', action='store_true',
                       help='Enable debug logging')
     args = parser.parse_args()
@@ -290,19 +633,20 @@ def main():
         questions = load_questions(args.questions_file)
         logger.info(f"{GREEN}Loaded {len(questions)} questions{RESET}")
 
+        # Load the model in the background while the PDF is processed
+        threading.Thread(target=preload_model, args=(args.model,),
+                         kwargs={"num_ctx": NUM_CTX * args.group_size}, daemon=True).start()
+
         # Step 2: Extract text from PDF
         print(f"\n{BLUE}{'='*20} Extracting PDF Text {'='*20}{RESET}")
         logger.info(f"{BLUE}Starting PDF text extraction...{RESET}")
         
         try:
             extractor = PDFExtractor(args.pdf_path)
-            text_chunks = extractor.extract_text(chunk_size=args.chunk_size)
-            
-            # Combine chunks into larger ones for context
-            text = ''.join(text_chunks)
-            large_chunks = chunk_text(text, args.chunk_size)
-            logger.info(f"{GREEN}Extracted {len(text_chunks)} text chunks{RESET}")
-            logger.info(f"{GREEN}Combined into {len(large_chunks)} large chunks for context{RESET}")
+            # Every chunk is needed before the context of a question can be
+            # chosen, so the chunks are collected rather than streamed
+            large_chunks = extractor.extract_text(chunk_size=args.chunk_size)
+            logger.info(f"{GREEN}Extracted {len(large_chunks)} text chunks for context{RESET}")
         except Exception as e:
             logger.error(f"{RED}Error during PDF extraction: {str(e)}{RESET}")
             raise
@@ -311,48 +655,46 @@ def main():
         print(f"\n{BLUE}{'='*20} Converting to GIFT Format {'='*20}{RESET}")
         logger.info(f"{BLUE}Starting conversion of {len(questions)} questions...{RESET}")
 
-        converter = GiftConverter()
-        gift_questions = []
-        
-        # Process each question with progress bar
-        for i, question in enumerate(tqdm(questions, desc="Questions converted", 
-                                        bar_format="{l_bar}%s{bar}%s{r_bar}" % (GREEN, RESET)), 1):
-            # Find most relevant chunk for this question
-            most_relevant_chunk = None
-            max_overlap = 0
-            
-            for chunk in large_chunks:
-                question_words = set(question['question'].lower().split())
-                chunk_words = set(chunk.lower().split())
-                overlap = len(question_words & chunk_words)
-                
-                if overlap > max_overlap:
-                    max_overlap = overlap
-                    most_relevant_chunk = chunk
-
-            if most_relevant_chunk:
-                gift_question = converter.convert_to_gift(question, most_relevant_chunk)
-                gift_questions.append(gift_question)
-                
-                # Show conversion in real-time if requested
-                if args.show_gift:
-                    logger.info(f"\n{YELLOW}Converting Question {i}:{RESET}")
-                    logger.info(f"{BLUE}Original (Aiken):{RESET}")
-                    logger.info(f"{question['question']}")
-                    for j, opt in enumerate(question['options']):
-                        logger.info(f"{chr(65 + j)}. {opt}")
-                    logger.info(f"ANSWER: {question['correct']}\n")
-                    logger.info(f"{GREEN}Converted (GIFT):{RESET}")
-                    logger.info(gift_question)
-            else:
+        # Pair each question with its most relevant chunk
+        cache_path = None if args.no_cache else args.cache_file
+        question_texts = [q['question'] for q in questions]
+        if args.embed_model:
+            logger.info(f"{BLUE}Finding context with embedding model {args.embed_model}...{RESET}")
+            best_chunks = find_relevant_chunks_semantic(question_texts, large_chunks, args.embed_model,
+                                                        cache_path=cache_path)
+        else:
+            best_chunks = find_relevant_chunks(question_texts, large_chunks)
+        pairs = []
+        for i, (question, best) in enumerate(zip(questions, best_chunks), 1):
+            if best is None:
                 logger.warning(f"{YELLOW}Could not find relevant context for question {i}{RESET}")
                 # Create basic GIFT format without detailed feedback
-                gift_question = converter.convert_to_gift(question, "")
-                gift_questions.append(gift_question)
+                pairs.append((question, ""))
+            else:
+                pairs.append((question, large_chunks[best]))
+
+        def on_converted(i: int, gift_question: str):
+            writer.write(gift_question)
+            
+            # Show conversion if requested
+            if args.show_gift:
+                question = questions[i]
+                logger.info(f"\n{YELLOW}Converting Question {i + 1}:{RESET}")
+                logger.info(f"{BLUE}Original (Aiken):{RESET}")
+                logger.info(f"{question['question']}")
+                for j, opt in enumerate(question['options']):
+                    logger.info(f"{LETTERS[j]}. {opt}")
+                logger.info(f"ANSWER: {question['correct']}\n")
+                logger.info(f"{GREEN}Converted (GIFT):{RESET}")
+                logger.info(gift_question)
 
-        # Step 4: Save results
-        print(f"\n{BLUE}{'='*20} Saving Results {'='*20}{RESET}")
-        save_gift_questions(gift_questions, args.output, batch_size=args.batch_size, show_gift=args.show_gift)
+        # Convert all questions concurrently, saving them as they complete
+        logger.info(f"{BLUE}Sending up to {OLLAMA_NUM_PARALLEL} concurrent requests to Ollama{RESET}")
+        with GiftWriter(args.output, len(pairs), batch_size=args.batch_size) as writer, \
+                tqdm(total=len(pairs), desc="Questions converted",
+                     bar_format="{l_bar}%s{bar}%s{r_bar}" % (GREEN, RESET)) as progress:
+            asyncio.run(convert_questions(pairs, on_converted, progress, cache_path, args.group_size, args.model))
+        logger.info(f"\n{GREEN}Completed saving all {writer.written} questions across {writer.num_batches} files{RESET}")
         
         # Print summary
         print(f"\n{BLUE}{'='*20} Conversion Summary {'='*20}{RESET}")
@@ -8,13 +8,14 @@ This script orchestrates the process of:
 """
 
 import os
+import asyncio
 import logging
 import argparse
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from tqdm import tqdm
 from pdf_extractor import PDFExtractor
 from question_generator import QuestionGenerator
-from utils import save_questions
+from utils import save_questions, OLLAMA_NUM_PARALLEL, LETTERS, DEFAULT_MODEL
 
 # Configure logging with colors
 logging.basicConfig(
@@ -30,7 +31,9 @@ YELLOW = "\033[93m"
 RED = "\033[91m"
 RESET = "\033[0m"
 
-def process_pdf(pdf_path: str, chunk_size: int = 4000, show_questions: bool = False) -> List[Dict[str, Any]]:
+def process_pdf(pdf_path: str, chunk_size: int = 4000, show_questions: bool = False,
+                cache_path: Optional[str] = "questions_cache.sqlite", batch_size: int = 1,
+                model: str = DEFAULT_MODEL) -> List[Dict[str, Any]]:
     """
     Process a PDF file to generate questions.
     
@@ -38,6 +41,10 @@ def process_pdf(pdf_path: str, chunk_size: int = 4000, show_questions: bool = Fa
         pdf_path (str): Path to PDF file
         chunk_size (int): Size of text chunks to process
         show_questions (bool): Whether to display questions as they're generated
+        cache_path (str, optional): SQLite file caching generated questions,
+                                    or None to disable the cache
+        batch_size (int): Number of chunks sent to the model in one request
+        model (str): Name of the Ollama model generating the questions
         
     Returns:
         List[Dict[str, Any]]: Generated questions
@@ -45,44 +52,50 @@ def process_pdf(pdf_path: str, chunk_size: int = 4000, show_questions: bool = Fa
     all_questions = []
     
     try:
-        # Step 1: Extract text from PDF
+        # Step 1: Read the PDF lazily, so questions are generated from the
+        # first chunks while the rest of the PDF is still being extracted
         print(f"\n{BLUE}{'='*20} Extracting PDF Text {'='*20}{RESET}")
         logger.info(f"{BLUE}Starting PDF text extraction...{RESET}")
         
         extractor = PDFExtractor(pdf_path)
-        text_chunks = extractor.extract_text()
+        text_chunks = extractor.iter_chunks(chunk_size)
         
-        logger.info(f"{GREEN}Successfully extracted {len(text_chunks)} text chunks{RESET}")
-        
-        # Step 2: Generate questions from chunks
+        # Step 2: Generate questions from chunks as they are extracted
         print(f"\n{BLUE}{'='*20} Generating Questions {'='*20}{RESET}")
-        logger.info(f"{BLUE}Initializing question generator with LLaMA 3.2...{RESET}")
+        logger.info(f"{BLUE}Initializing question generator with {model}...{RESET}")
+        logger.info(f"{BLUE}Sending up to {OLLAMA_NUM_PARALLEL} concurrent requests to Ollama{RESET}")
+        
+        def on_generated(i: int, result):
+            progress.update(1)
+            if isinstance(result, Exception):
+                logger.error(f"{RED}Error processing chunk {i + 1}: {str(result)}{RESET}")
+                return
+            
+            if show_questions:
+                print(f"\n{YELLOW}Generated {len(result)} questions from chunk {i + 1}:{RESET}")
+                for q in result:
+                    print(f"\n{YELLOW}Question: {q['question']}")
+                    for j, opt in enumerate(q['options']):
+                        print(f"{LETTERS[j]}. {opt}")
+                    print(f"ANSWER: {q['correct']}{RESET}")
         
-        generator = QuestionGenerator()
-        total_chunks = len(text_chunks)
+        async def generate():
+            async with QuestionGenerator(model=model, cache_path=cache_path, batch_size=batch_size) as generator:
+                return await generator.agenerate_many(text_chunks, on_generated=on_generated)
         
         # Use tqdm for progress tracking
-        for i, chunk in enumerate(tqdm(text_chunks, desc="Processing chunks", 
-                                     bar_format="{l_bar}%s{bar}%s{r_bar}" % (GREEN, RESET)), 1):
-            logger.info(f"\n{BLUE}Processing chunk {i}/{total_chunks}{RESET}")
-            
-            try:
-                questions = generator.generate_questions(chunk)
-                all_questions.extend(questions)
-                
-                if show_questions:
-                    print(f"\n{YELLOW}Generated {len(questions)} questions from chunk {i}:{RESET}")
-                    for q in questions:
-                        print(f"\n{YELLOW}Question: {q['question']}")
-                        for j, opt in enumerate(q['options']):
-                            print(f"{chr(65 + j)}. {opt}")
-                        print(f"ANSWER: {q['correct']}{RESET}")
-                
-            except Exception as e:
-                logger.error(f"{RED}Error processing chunk {i}: {str(e)}{RESET}")
-                continue
+        with tqdm(desc="Processing chunks", unit="chunk",
+                  bar_format="{l_bar}%s{bar}%s{r_bar}" % (GREEN, RESET)) as progress:
+            results = asyncio.run(generate())
+        
+        # Keep the questions in chunk order, skipping chunks that failed
+        total_chunks = len(results)
+        for result in results:
+            if not isinstance(result, Exception):
+                all_questions.extend(result)
         
         logger.info(f"\n{GREEN}Question Generation Complete!")
+        logger.info(f"Total chunks processed: {total_chunks}")
         logger.info(f"Total questions generated: {len(all_questions)}{RESET}")
         
         return all_questions
@@ -100,6 +113,14 @@ def main():
                       help='Output file path (default: questions.txt)')
     parser.add_argument('--show-questions', action='store_true',
                       help='Display questions as they are generated')
+    parser.add_argument('--model', default=DEFAULT_MODEL,
+                      help=f'Ollama model generating the questions (default: {DEFAULT_MODEL})')
+    parser.add_argument('--batch-size', type=int, default=1,
+                      help='Number of chunks sent to the model in one request (default: 1)')
+    parser.add_argument('--cache-file', default='questions_cache.sqlite',
+                      help='SQLite file caching generated questions between runs (default: questions_cache.sqlite)')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Always regenerate questions instead of using the cache')
     parser.add_argument('--debug', action='store_true',
                       help='Enable debug logging')
     
@@ -113,7 +134,9 @@ def main():
         logger.info(f"{BLUE}Starting question generation process...{RESET}")
         
         # Process PDF and generate questions
-        questions = process_pdf(args.pdf_path, args.chunk_size, args.show_questions)
+        cache_path = None if args.no_cache else args.cache_file
+        questions = process_pdf(args.pdf_path, args.chunk_size, args.show_questions, cache_path,
+                                args.batch_size, args.model)
         
         # Save questions
         print(f"\n{BLUE}{'='*20} Saving Questions {'='*20}{RESET}")
@@ -3,16 +3,25 @@ PDF Extractor module for the PDF Question Extractor project.
 
 This module handles the extraction of text from PDF documents and splits it into
 manageable chunks for processing. It includes features for:
-- Reading PDF files using PyPDF2
+- Reading PDF files using PyMuPDF, extracting pages in parallel
 - Cleaning and normalizing extracted text
-- Splitting text into chunks while preserving context
+- Splitting text into chunks while preserving context, as pages are extracted
+- Caching extracted chunks on disk, so unchanged PDFs are only read once
 - Handling PDF reading errors gracefully
 """
 
-import PyPDF2
+import os
+import json
+import hashlib
+import tempfile
+import pymupdf
 import logging
-from typing import List
-from utils import chunk_text
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+from pathlib import Path
+from typing import List, Optional, Iterator
+from utils import stream_chunks
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
@@ -24,104 +33,215 @@ YELLOW = "\033[93m"
 RED = "\033[91m"
 RESET = "\033[0m"
 
+# Directory where extracted chunks are cached
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "aiken"
+
+# Bump when cleaning or chunking changes, so cached chunks are extracted again
+EXTRACTION_VERSION = 3
+
+# Number of pages extracted by each worker task. PyMuPDF is not thread-safe,
+# so pages are extracted in worker processes that open their own document.
+PAGES_PER_TASK = 16
+
+def _clean_text(text: str) -> str:
+    """
+    Clean and normalize extracted text.
+    
+    Periods are surrounded by spaces, and every run of whitespace
+    (including line breaks and non-breaking spaces) becomes a single space.
+    
+    Args:
+        text (str): Raw text from PDF
+        
+    Returns:
+        str: Cleaned text
+    """
+    # Add space around periods, then collapse all whitespace in one pass.
+    # str.split() without arguments splits on any whitespace run and is
+    # faster than the equivalent regular expression substitution.
+    return ' '.join(text.replace('.', ' . ').split())
+
+def _extract_pages(pdf_path: str, start: int, stop: int) -> List[str]:
+    """
+    Extract and clean the text of a range of pages. Runs in a worker process,
+    so cleaning is spread over the workers along with extraction.
+    
+    Args:
+        pdf_path (str): Path to PDF file
+        start (int): Index of the first page
+        stop (int): Index after the last page
+        
+    Returns:
+        List[str]: Cleaned text of each page in the range
+    """
+    with pymupdf.open(pdf_path) as doc:
+        return [_clean_text(doc[i].get_text("text")) for i in range(start, stop)]
+
 class PDFExtractor:
-    def __init__(self, pdf_path: str = None):
+    def __init__(self, pdf_path: str = None, workers: Optional[int] = None,
+                 cache_dir: Optional[Path] = DEFAULT_CACHE_DIR):
         """
         Initialize PDF extractor.
         
         Args:
             pdf_path (str, optional): Path to PDF file
+            workers (int, optional): Number of processes extracting pages
+                                     (default: number of CPUs)
+            cache_dir (Path, optional): Directory caching extracted chunks,
+                                        or None to disable the cache
         """
         self.pdf_path = pdf_path
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
         
-    def extract_text(self, chunk_size: int = 4000) -> List[str]:
+    def _cache_file(self, chunk_size: int) -> Path:
         """
-        Extract text from PDF and split into chunks.
+        Get the cache file for the chunks of this PDF.
+        
+        The name depends on the file's path, modification time and size, so
+        a modified PDF is extracted again.
+        
+        Args:
+            chunk_size (int): Size of text chunks
+            
+        Returns:
+            Path: Path of the cache file
+        """
+        key = (f"{os.path.abspath(self.pdf_path)}:{os.path.getmtime(self.pdf_path)}:"
+               f"{os.path.getsize(self.pdf_path)}:{chunk_size}:{EXTRACTION_VERSION}")
+        return Path(self.cache_dir) / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.jsonl"
+        
+    def iter_pages(self) -> Iterator[str]:
+        """
+        Extract the cleaned text of each page, in order.
+        
+        Pages are extracted and cleaned in worker processes ahead of the
+        consumer, so the extraction continues while the caller processes the
+        pages already yielded. Empty pages are skipped.
+        
+        Yields:
+            str: Cleaned text of a page
+        """
+        logger.info(f"{BLUE}Opening PDF file: {self.pdf_path}{RESET}")
+        with pymupdf.open(self.pdf_path) as doc:
+            total_pages = doc.page_count
+            
+        total_chars = 0
+        logger.info(f"{BLUE}Processing {total_pages} pages...{RESET}")
+        
+        # Extract text from page ranges, in parallel for larger documents
+        ranges = [(start, min(start + PAGES_PER_TASK, total_pages))
+                  for start in range(0, total_pages, PAGES_PER_TASK)]
+        starts = [start for start, _ in ranges]
+        stops = [stop for _, stop in ranges]
+        
+        parallel = len(ranges) > 1 and self.workers > 1
+        executor = ProcessPoolExecutor(max_workers=min(self.workers, len(ranges))) if parallel else None
+        
+        with executor or nullcontext(), tqdm(total=total_pages, desc="Extracting pages",
+                                             bar_format="{l_bar}{bar}{r_bar}") as progress:
+            extract_map = executor.map if executor else map
+            results = extract_map(_extract_pages, repeat(self.pdf_path), starts, stops)
+            for start, page_texts in zip(starts, results):
+                for page_text in page_texts:
+                    total_chars += len(page_text)
+                    if page_text:
+                        yield page_text
+                progress.update(len(page_texts))
+                logger.debug("Extracted pages %d-%d/%d", start + 1, start + len(page_texts), total_pages)
+                
+        logger.info(f"{GREEN}Text extraction completed")
+        logger.info(f"Total characters extracted: {total_chars:,}{RESET}")
+        
+    def iter_chunks(self, chunk_size: int = 4000) -> Iterator[str]:
+        """
+        Extract text from PDF and yield it in chunks as pages are extracted.
+        
+        Chunks are written to the cache as they are yielded; the cache file
+        is only completed once the whole PDF has been read.
         
         Args:
             chunk_size (int): Size of text chunks to process (default: 4000)
         
-        Returns:
-            List[str]: List of text chunks
+        Yields:
+            str: Text chunks
             
         Raises:
             FileNotFoundError: If PDF file not found
-            PyPDF2.errors.PdfReadError: If PDF cannot be read
+            pymupdf.FileDataError: If PDF cannot be read
         """
         if not self.pdf_path:
             raise ValueError("PDF path not set")
             
         try:
-            logger.info(f"{BLUE}Opening PDF file: {self.pdf_path}{RESET}")
-            with open(self.pdf_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text = ""
-                total_chars = 0
-                
-                # Extract text from each page with progress bar
-                total_pages = len(reader.pages)
-                logger.info(f"{BLUE}Processing {total_pages} pages...{RESET}")
-                
-                for i in tqdm(range(total_pages), desc="Extracting pages", 
-                            bar_format="{l_bar}{bar}{r_bar}"):
-                    page = reader.pages[i]
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-                        total_chars += len(page_text)
-                    logger.debug(f"Extracted page {i+1}/{total_pages}")
-                        
-                # Clean and normalize text
-                text = self._clean_text(text)
-                logger.info(f"{GREEN}Text extraction completed")
-                logger.info(f"Total characters extracted: {total_chars:,}{RESET}")
-                
-                # Split into chunks
-                chunks = chunk_text(text, chunk_size)
-                valid_chunks = [chunk for chunk in chunks if len(chunk.strip()) > 100]  # Filter out very small chunks
+            cache_file = self._cache_file(chunk_size) if self.cache_dir else None
+            if cache_file and cache_file.exists():
+                logger.info(f"{GREEN}Loading text chunks from cache {cache_file}{RESET}")
+                with open(cache_file, encoding='utf-8') as f:
+                    for line in f:
+                        yield json.loads(line)
+                return
                 
-                # Log chunk statistics
-                total_chunks = len(chunks)
-                valid_chunk_count = len(valid_chunks)
-                avg_chunk_size = sum(len(chunk) for chunk in valid_chunks) / valid_chunk_count if valid_chunk_count > 0 else 0
+            cache = None
+            if cache_file:
+                # Write to a temporary file first, so an interrupted extraction never leaves a broken
+                # cache. Its name is unique, so concurrent runs on the same PDF do not share it.
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                cache = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=cache_file.parent,
+                                                    prefix=cache_file.stem + '.', suffix='.tmp', delete=False)
                 
-                logger.info(f"{GREEN}Extracted {valid_chunk_count:,} valid text chunks")
-                logger.info(f"Average chunk size: {avg_chunk_size:,.0f} characters")
-                if total_chunks != valid_chunk_count:
-                    logger.info(f"{YELLOW}Filtered out {total_chunks - valid_chunk_count} small chunks{RESET}")
+            try:
+                # Pages are separated by a single space, as in the cleaned text
+                pages = (page if i == 0 else ' ' + page for i, page in enumerate(self.iter_pages()))
                 
-                return valid_chunks
+                filtered = 0
+                with cache or nullcontext():
+                    for chunk in stream_chunks(pages, chunk_size):
+                        if len(chunk.strip()) <= 100:  # Filter out very small chunks
+                            filtered += 1
+                            continue
+                        if cache:
+                            cache.write(json.dumps(chunk) + '\n')
+                        yield chunk
+                        
+                if filtered:
+                    logger.info(f"{YELLOW}Filtered out {filtered} small chunks{RESET}")
+                if cache:
+                    os.replace(cache.name, cache_file)
+            finally:
+                # Left behind when the caller stops early or extraction fails
+                if cache:
+                    Path(cache.name).unlink(missing_ok=True)
                 
-        except FileNotFoundError:
+        except (FileNotFoundError, pymupdf.FileNotFoundError):
             logger.error(f"{RED}PDF file not found: {self.pdf_path}{RESET}")
             raise
-        except PyPDF2.errors.PdfReadError as e:
+        except pymupdf.FileDataError as e:
             logger.error(f"{RED}Error reading PDF: {str(e)}{RESET}")
             raise
         except Exception as e:
             logger.error(f"{RED}Unexpected error: {str(e)}{RESET}")
             raise
             
-    def _clean_text(self, text: str) -> str:
+    def extract_text(self, chunk_size: int = 4000) -> List[str]:
         """
-        Clean and normalize extracted text.
+        Extract text from PDF and split into chunks.
         
         Args:
-            text (str): Raw text from PDF
-            
+            chunk_size (int): Size of text chunks to process (default: 4000)
+        
         Returns:
-            str: Cleaned text
+            List[str]: List of text chunks
+            
+        Raises:
+            FileNotFoundError: If PDF file not found
+            pymupdf.FileDataError: If PDF cannot be read
         """
-        # Remove excessive whitespace
-        text = ' '.join(text.split())
-        
-        # Normalize line endings
-        text = text.replace('\r\n', '\n')
-        
-        # Add space after periods if missing
-        text = text.replace('.',' . ').replace('  ', ' ')
+        chunks = list(self.iter_chunks(chunk_size))
         
-        # Remove any non-breaking spaces
-        text = text.replace('\xa0', ' ')
+        # Log chunk statistics
+        avg_chunk_size = sum(len(chunk) for chunk in chunks) / len(chunks) if chunks else 0
+        logger.info(f"{GREEN}Extracted {len(chunks):,} valid text chunks")
+        logger.info(f"Average chunk size: {avg_chunk_size:,.0f} characters{RESET}")
         
-        return text
+        return chunks
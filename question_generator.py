@@ -6,35 +6,101 @@ via Ollama API. It includes features for:
 - Generating contextually relevant questions from text chunks
 - Parsing and validating generated questions
 - Converting questions to Aiken format
-- Handling model API communication
+- Handling model API communication, with several chunks in flight at once
+- Caching generated questions, so unchanged chunks are only sent once
 """
 
+import re
 import json
+import asyncio
+import sqlite3
 import logging
-import requests
-from typing import List, Dict, Any, Optional
-from utils import validate_aiken_format
+import aiohttp
+import orjson
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterable, Callable
+from utils import validate_aiken_format, iter_aiken_questions
+from utils import create_session, open_cache, cache_key, OLLAMA_NUM_PARALLEL, DEFAULT_MODEL
 
 logger = logging.getLogger(__name__)
 
+# Bump when the question prompt changes, so cached questions are regenerated
+PROMPT_VERSION = 2
+
+# Maximum length of the text pasted into a prompt (about 1500 tokens at ~4
+# characters per token). Longer texts are cut at the last sentence end.
+MAX_TEXT_CHARS = 6000
+
+# Context window requested from Ollama for each passage of a request. It
+# must fit the prompt and the generated questions, and stay the same for
+# every request, since changing it makes Ollama reload the model.
+NUM_CTX = 4096
+
+# Retries of failed requests: connection errors and server errors (5xx) are
+# retried with exponential backoff, starting at RETRY_BASE_DELAY seconds
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# Marker the model writes before the questions of each passage of a batch
+_PASSAGE_RE = re.compile(r'^\s*=== DOMANDE PER IL PASSAGGIO (\d+) ===\s*$', re.MULTILINE)
+
 class QuestionGenerator:
     """
     A class to generate multiple-choice questions using LLaMA 3.2 model.
+    
+    The generator must be used as an async context manager, which owns the
+    HTTP session shared by all requests:
+    
+        async with QuestionGenerator() as generator:
+            questions = await generator.agenerate_questions(text)
     """
     
-    def __init__(self, model: str = "llama3.2", base_url: str = "http://localhost:11434"):
+    def __init__(self, model: str = DEFAULT_MODEL, base_url: str = "http://localhost:11434",
+                 cache_path: Optional[str] = "questions_cache.sqlite", batch_size: int = 1):
         """
         Initialize the question generator.
         
         Args:
             model (str): Name of the Ollama model to use
             base_url (str): Base URL for the Ollama API
+            cache_path (str, optional): SQLite file caching generated questions,
+                                        or None to disable the cache
+            batch_size (int): Maximum number of texts sent in one request by
+                              agenerate_many; the context window grows with it
         """
         self.model = model
         self.base_url = base_url
         self.api_url = f"{base_url}/api/generate"
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.num_ctx = NUM_CTX * batch_size
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.cache: Optional[sqlite3.Connection] = None
+        
+    async def __aenter__(self) -> "QuestionGenerator":
+        self.session = create_session()
+        if self.cache_path:
+            self.cache = open_cache(self.cache_path, "CREATE TABLE IF NOT EXISTS questions (key BLOB PRIMARY KEY, questions TEXT)")
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+            
+    def _cache_key(self, text: str, num_questions: int) -> bytes:
+        """
+        Build the cache key for the questions generated from a text.
         
-    def generate_questions(self, text: str, num_questions: int = 5) -> List[Dict[str, Any]]:
+        The key covers everything the questions depend on: the text, the
+        number of questions, the model and the prompt version.
+        """
+        return cache_key(text, str(num_questions), self.model, str(PROMPT_VERSION))
+        
+    async def agenerate_questions(self, text: str, num_questions: int = 5) -> List[Dict[str, Any]]:
         """
         Generate multiple-choice questions from text.
         
@@ -50,37 +116,187 @@ class QuestionGenerator:
         - 'options': List of 4 options
         - 'correct': Correct answer letter (A, B, C, or D)
         """
-        prompt = self._create_prompt(text, num_questions)
+        return (await self.agenerate_questions_batch([text], num_questions))[0]
         
-        try:
-            response = requests.post(
-                self.api_url,
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False
-                }
-            )
-            response.raise_for_status()
-            
-            # Parse response and extract questions
-            questions = self._parse_response(response.json()['response'])
-            
-            # Validate and filter questions
-            valid_questions = []
-            for q in questions:
-                if validate_aiken_format(q):
-                    valid_questions.append(q)
-                else:
-                    logger.warning(f"Invalid question format: {q.get('question', '')[:50]}...")
+    async def agenerate_questions_batch(self, texts: List[str], num_questions: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        Generate multiple-choice questions from several texts with a single request.
+        
+        The texts are numbered passages of one prompt, and the model marks the
+        questions of each passage, so the instructions are processed once for
+        all of them. Texts found in the cache are not sent.
+        
+        Args:
+            texts (List[str]): Input texts to generate questions from
+            num_questions (int): Number of questions to generate per text
+            
+        Returns:
+            List[List[Dict[str, Any]]]: Generated questions of each text, in order
+        """
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(texts)
+        cache_keys = []
+        if self.cache:
+            cache_keys = [self._cache_key(text, num_questions) for text in texts]
+            for i, key in enumerate(cache_keys):
+                row = self.cache.execute("SELECT questions FROM questions WHERE key = ?", (key,)).fetchone()
+                if row:
+                    results[i] = json.loads(row[0])
                     
-            logger.info(f"Generated {len(valid_questions)} valid questions")
-            return valid_questions
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
             
-        except requests.exceptions.RequestException as e:
+        if len(pending) == 1:
+            prompt = self._create_prompt(texts[pending[0]], num_questions)
+        else:
+            prompt = self._create_batch_prompt([texts[i] for i in pending], num_questions)
+        
+        try:
+            response = await self._call_ollama(prompt)
+            
+            if len(pending) == 1:
+                blocks = [response]
+            else:
+                blocks = self._split_passages(response, len(pending))
+                if blocks is None:
+                    # Questions without passage markers cannot be matched to
+                    # their passages, so each text is sent on its own instead
+                    logger.warning("Response has no passage markers, sending %d texts separately", len(pending))
+                    for i in pending:
+                        results[i] = (await self.agenerate_questions_batch([texts[i]], num_questions))[0]
+                    return results
+            
+            for i, block in zip(pending, blocks):
+                # Parse the response and validate questions in a single pass
+                valid_questions = []
+                for q in iter_aiken_questions(block):
+                    if validate_aiken_format(q):
+                        valid_questions.append(q)
+                    else:
+                        logger.warning("Invalid question format: %.50s...", q.get('question', ''))
+                        
+                logger.info("Generated %d valid questions", len(valid_questions))
+                results[i] = valid_questions
+                # An empty result means the response could not be parsed, so
+                # it is not cached and the text is sent again on the next run
+                if self.cache and valid_questions:
+                    self.cache.execute("INSERT OR REPLACE INTO questions VALUES (?, ?)",
+                                       (cache_keys[i], json.dumps(valid_questions)))
+            if self.cache:
+                self.cache.commit()
+            return results
+            
+        except aiohttp.ClientError as e:
             logger.error(f"API request failed: {str(e)}")
             raise
             
+    async def _call_ollama(self, prompt: str) -> str:
+        """
+        Send a prompt to the Ollama API and return the generated text.
+        
+        Connection errors and server errors (5xx), e.g. while Ollama is
+        starting or loading the model, are retried with exponential backoff.
+        Other errors, such as an unknown model, are raised immediately.
+        
+        Args:
+            prompt (str): Prompt to send
+            
+        Returns:
+            str: Text generated by the model
+        """
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                async with self.session.post(
+                    self.api_url,
+                    json={
+                        "model": self.model,
+                        "prompt": prompt,
+                        "stream": False,
+                        "options": {
+                            "num_ctx": self.num_ctx
+                        }
+                    }
+                ) as response:
+                    response.raise_for_status()
+                    result = orjson.loads(await response.read())
+                return result['response']
+                
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError) as e:
+                server_error = not isinstance(e, aiohttp.ClientResponseError) or e.status >= 500
+                if not server_error or attempt == RETRY_ATTEMPTS:
+                    raise
+                delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+                logger.warning(f"API request failed ({str(e)}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                
+    async def agenerate_many(self, texts: Iterable[str], num_questions: int = 5,
+                             on_generated: Optional[Callable[[int, Any], None]] = None) -> List[Any]:
+        """
+        Generate questions from many texts, keeping up to OLLAMA_NUM_PARALLEL
+        requests in flight, each covering up to `batch_size` texts.
+        
+        Texts are taken from the iterable only when a request slot is free, so
+        a lazy iterable (e.g. PDFExtractor.iter_chunks) is read while earlier
+        texts are being processed, and only the texts in flight are held in memory.
+        
+        Args:
+            texts (Iterable[str]): Input texts to generate questions from
+            num_questions (int): Number of questions to generate per text
+            on_generated (Callable[[int, Any], None], optional): Called with the
+                index of each text and its result as soon as it completes
+            
+        Returns:
+            List[Any]: For each text, in order, its list of questions or the
+                       exception raised while generating them
+        """
+        semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+        loop = asyncio.get_running_loop()
+        texts = iter(texts)
+        tasks = []
+        count = 0
+        
+        async def generate(start: int, batch: List[str]) -> List[Any]:
+            try:
+                results = await self.agenerate_questions_batch(batch, num_questions)
+            except Exception as e:
+                results = [e] * len(batch)
+            finally:
+                semaphore.release()
+            if on_generated:
+                for offset, result in enumerate(results):
+                    on_generated(start + offset, result)
+            return results
+        
+        while True:
+            await semaphore.acquire()
+            # Reading the next texts may extract PDF pages, so keep it off the event
+            # loop (run_in_executor rather than asyncio.to_thread, for Python 3.8)
+            batch = await loop.run_in_executor(None, list, islice(texts, self.batch_size))
+            if not batch:
+                semaphore.release()
+                break
+            tasks.append(asyncio.create_task(generate(count, batch)))
+            count += len(batch)
+            
+        return [result for results in await asyncio.gather(*tasks) for result in results]
+        
+    @staticmethod
+    def _trim_text(text: str) -> str:
+        """
+        Cut a text longer than MAX_TEXT_CHARS at the last sentence end within
+        the limit, so the prompt never outgrows the context window.
+        
+        Args:
+            text (str): Input text
+            
+        Returns:
+            str: Text of at most MAX_TEXT_CHARS characters
+        """
+        if len(text) <= MAX_TEXT_CHARS:
+            return text
+        end = text.rfind('. ', 0, MAX_TEXT_CHARS)
+        return text[:end + 1] if end > 0 else text[:MAX_TEXT_CHARS]
+            
     def _create_prompt(self, text: str, num_questions: int) -> str:
         """
         Create a prompt for the LLaMA model.
@@ -92,76 +308,73 @@ class QuestionGenerator:
         Returns:
             str: Formatted prompt
         """
-        return f"""
-        Genera {num_questions} domande a scelta multipla in italiano basate sul seguente testo.
-        Ogni domanda deve avere esattamente 4 opzioni (A, B, C, D) e una sola risposta corretta.
-        Usa il formato Aiken:
+        return f"""Genera {num_questions} domande a scelta multipla in italiano basate sul testo seguente.
+Ogni domanda ha 4 opzioni e una sola risposta corretta. Formato Aiken:
+
+[Domanda]
+A. [Opzione]
+B. [Opzione]
+C. [Opzione]
+D. [Opzione]
+ANSWER: [Lettera]
 
-        [Testo della domanda]
-        A. [Opzione A]
-        B. [Opzione B]
-        C. [Opzione C]
-        D. [Opzione D]
-        ANSWER: [Lettera della risposta corretta]
+Testo:
+{self._trim_text(text)}"""
 
-        Testo:
-        {text}
+    def _create_batch_prompt(self, texts: List[str], num_questions: int) -> str:
         """
+        Create a prompt asking for questions on each of several passages.
         
-    def _parse_response(self, response: str) -> List[Dict[str, Any]]:
+        Args:
+            texts (List[str]): Input texts, one per passage
+            num_questions (int): Number of questions to generate per passage
+            
+        Returns:
+            str: Formatted prompt
         """
-        Parse the model's response into structured question dictionaries.
+        passages = "\n".join(f"=== PASSAGGIO {i} ===\n{self._trim_text(text)}"
+                              for i, text in enumerate(texts, 1))
+        return f"""Genera {num_questions} domande a scelta multipla in italiano per CIASCUNO dei {len(texts)} passaggi seguenti.
+Ogni domanda ha 4 opzioni e una sola risposta corretta. Formato Aiken.
+Prima delle domande di ogni passaggio scrivi la riga "=== DOMANDE PER IL PASSAGGIO N ===", dove N è il numero del passaggio:
+
+=== DOMANDE PER IL PASSAGGIO 1 ===
+[Domanda]
+A. [Opzione]
+B. [Opzione]
+C. [Opzione]
+D. [Opzione]
+ANSWER: [Lettera]
+
+{passages}"""
+
+    @staticmethod
+    def _split_passages(response: str, count: int) -> Optional[List[str]]:
+        """
+        Split a batched response into the output for each passage.
+        
+        Text before the first marker belongs to the first passage if the
+        model left out the marker of that passage.
         
         Args:
             response (str): Raw response from the model
+            count (int): Number of passages in the prompt
             
         Returns:
-            List[Dict[str, Any]]: List of parsed questions
+            Optional[List[str]]: Response text of each passage, empty if the
+                                 model wrote nothing for it, or None if the
+                                 response has no passage markers at all
         """
-        questions = []
-        current_question = None
-        current_options = []
-        
-        for line in response.split('\n'):
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Start new question if line doesn't start with a letter or ANSWER
-            if not (line.startswith(('A.', 'B.', 'C.', 'D.', 'ANSWER:'))):
-                if current_question and current_options:
-                    questions.append({
-                        'question': current_question,
-                        'options': current_options,
-                        'correct': None
-                    })
-                current_question = line
-                current_options = []
-                continue
-                
-            # Parse options
-            if line.startswith(('A.', 'B.', 'C.', 'D.')):
-                option_text = line[2:].strip()
-                current_options.append(option_text)
-                
-            # Parse answer
-            elif line.startswith('ANSWER:'):
-                answer = line[7:].strip()
-                if current_question and current_options:
-                    questions.append({
-                        'question': current_question,
-                        'options': current_options,
-                        'correct': answer
-                    })
-                current_question = None
-                current_options = []
-                
-        # Add last question if exists
-        if current_question and current_options:
-            questions.append({
-                'question': current_question,
-                'options': current_options,
-                'correct': None
-            })
-            
-        return questions
+        parts = _PASSAGE_RE.split(response)
+        if len(parts) == 1:
+            return None
+            
+        blocks = [''] * count
+        # parts alternates text before a marker, a passage number and its text
+        for number, block in zip(parts[1::2], parts[2::2]):
+            index = int(number) - 1
+            if 0 <= index < count:
+                blocks[index] += block
+        if all(int(number) != 1 for number in parts[1::2]):
+            blocks[0] = parts[0] + blocks[0]
+        return blocks
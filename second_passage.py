@@ -12,18 +12,24 @@ Features:
 - Maintains Aiken format compatibility
 - Preserves original questions file
 - Shows progress with color-coded output
+- Validates several questions concurrently
 
 Usage:
     python second_passage.py codice_civ.pdf questions.txt --output improved_questions.txt
 """
 
+import json
+import sqlite3
+import asyncio
 import logging
 import argparse
-import requests
-from typing import List, Dict, Any
+import aiohttp
+import orjson
+from typing import List, Dict, Any, Tuple, Optional, Callable
 from tqdm import tqdm
 from pdf_extractor import PDFExtractor
-from utils import chunk_text, load_questions
+from utils import load_questions, iter_aiken_questions, validate_aiken_format, find_relevant_chunks
+from utils import create_session, open_cache, cache_key, OLLAMA_NUM_PARALLEL, LETTERS, DEFAULT_MODEL
 
 # Configure logging with colors for better readability
 logging.basicConfig(
@@ -39,6 +45,9 @@ YELLOW = "\033[93m"
 RED = "\033[91m"
 RESET = "\033[0m"
 
+# Seconds without any data from Ollama after which a request fails
+READ_TIMEOUT = 300
+
 class QuestionValidator:
     """
     A class that validates and improves questions using the LLaMA 3.2 model.
@@ -46,20 +55,56 @@ class QuestionValidator:
     This class takes questions in Aiken format and their corresponding context
     from a PDF, then uses the LLaMA model to either approve them as-is or suggest
     improvements while maintaining the original intent.
+    
+    The validator must be used as an async context manager, which owns the
+    HTTP session shared by all requests:
+    
+        async with QuestionValidator() as validator:
+            improved = await validator.run_all(pairs)
     """
     
-    def __init__(self, model: str = "llama3.2", base_url: str = "http://localhost:11434"):
+    def __init__(self, model: str = DEFAULT_MODEL, base_url: str = "http://localhost:11434",
+                 cache_path: Optional[str] = "validation_cache.sqlite"):
         """
         Initialize the validator with model settings.
         
         Args:
-            model (str): Name of the Ollama model to use (default: llama3.2)
+            model (str): Name of the Ollama model to use
             base_url (str): Base URL for the Ollama API
+            cache_path (str, optional): SQLite file caching validated questions,
+                                        or None to disable the cache
         """
         self.model = model
         self.api_url = f"{base_url}/api/generate"
+        self.cache_path = cache_path
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.cache: Optional[sqlite3.Connection] = None
+        
+    async def __aenter__(self) -> "QuestionValidator":
+        # Responses are streamed, so a request only fails if Ollama sends
+        # nothing for READ_TIMEOUT seconds
+        self.session = create_session(read_timeout=READ_TIMEOUT)
+        if self.cache_path:
+            self.cache = open_cache(self.cache_path, "CREATE TABLE IF NOT EXISTS validation (key BLOB PRIMARY KEY, question TEXT)")
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+            
+    def _cache_key(self, prompt: str) -> bytes:
+        """
+        Build the cache key for the answer to a validation prompt.
         
-    def validate_and_improve_question(self, question: Dict[str, Any], context: str) -> Dict[str, Any]:
+        The prompt contains the question and its context, so the key only
+        needs the prompt and the model.
+        """
+        return cache_key(prompt, self.model)
+        
+    async def validate_and_improve_question(self, question: Dict[str, Any], context: str) -> Dict[str, Any]:
         """
         Validate and potentially improve a single question.
         
@@ -97,51 +142,100 @@ ANSWER: [Lettera corretta]
 
 Migliora la chiarezza e la precisione della domanda mantenendo lo stesso concetto."""
 
+        key = None
+        if self.cache:
+            key = self._cache_key(prompt)
+            row = self.cache.execute("SELECT question FROM validation WHERE key = ?", (key,)).fetchone()
+            if row:
+                return json.loads(row[0])
+        
         try:
-            # Send request to Ollama API
-            response = requests.post(
+            # Stream the response from Ollama API and join its parts. Some
+            # Ollama versions stall for minutes on non-streamed responses.
+            parts = []
+            async with self.session.post(
                 self.api_url,
                 json={
                     "model": self.model,
                     "prompt": prompt,
-                    "stream": False,
+                    "stream": True,
                     "options": {
                         "temperature": 0.1  # Low temperature for more consistent output
                     }
                 }
-            )
-            response.raise_for_status()
-            result = response.json()['response'].strip()
-            
-            # If model says OK, keep original question
-            if result == "OK":
-                return question
-            else:
-                # Parse the improved question from model's response
-                lines = result.split('\n')
-                improved_question = {
-                    'question': lines[0].strip(),
-                    'options': [],
-                    'correct': None
-                }
-                
-                # Extract options and correct answer
-                for line in lines[1:]:
-                    line = line.strip()
-                    if line.startswith(('A.', 'B.', 'C.', 'D.')):
-                        improved_question['options'].append(line[2:].strip())
-                    elif line.startswith('ANSWER:'):
-                        improved_question['correct'] = line.split(':')[1].strip()
-                
-                # Return improved version only if it's complete and valid
-                if len(improved_question['options']) == 4 and improved_question['correct']:
-                    return improved_question
-                else:
-                    return question
-                    
+            ) as response:
+                response.raise_for_status()
+                async for raw_line in response.content:
+                    if not raw_line.strip():
+                        continue
+                    # orjson parses the raw bytes, without decoding them to str first
+                    chunk = orjson.loads(raw_line)
+                    if 'error' in chunk:
+                        raise RuntimeError(chunk['error'])
+                    parts.append(chunk.get('response', ''))
+                    if chunk.get('done'):
+                        break
+            result = ''.join(parts).strip()
         except Exception as e:
+            # Failed requests are not cached, so the question is sent again next time
             logger.error(f"{RED}Error improving question: {str(e)}{RESET}")
             return question
+        
+        # If model says OK, keep original question; otherwise keep the first
+        # complete and valid question of the response
+        if result == "OK":
+            improved_question = question
+        else:
+            improved_question = next((q for q in iter_aiken_questions(result) if validate_aiken_format(q)), None)
+            if improved_question is None:
+                # Refusals, truncated output and prose are not cached, so the
+                # question is validated again next time
+                logger.warning("Unusable validation response: %.50s...", result)
+                return question
+        
+        if self.cache:
+            self.cache.execute("INSERT OR REPLACE INTO validation VALUES (?, ?)",
+                               (key, json.dumps(improved_question)))
+            self.cache.commit()
+        return improved_question
+
+    async def run_all(self, pairs: List[Tuple[Dict[str, Any], Optional[str]]],
+                      on_validated: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Validate and improve many questions, keeping up to OLLAMA_NUM_PARALLEL
+        requests in flight.
+        
+        Identical questions with the same context are sent to the model only
+        once and share the result.
+        
+        Args:
+            pairs (List[Tuple[Dict[str, Any], Optional[str]]]): (question, context)
+                pairs; questions without context are kept unchanged
+            on_validated (Callable[[int, Dict[str, Any]], None], optional): Called
+                with the index of each question and its result as soon as it completes
+            
+        Returns:
+            List[Dict[str, Any]]: Resulting questions, in the same order as `pairs`
+        """
+        semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+        improving: Dict[Tuple[str, str], asyncio.Task] = {}
+        
+        async def improve(question: Dict[str, Any], context: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.validate_and_improve_question(question, context)
+        
+        async def validate(index: int, question: Dict[str, Any], context: Optional[str]) -> Dict[str, Any]:
+            if context:
+                key = (json.dumps(question, sort_keys=True), context)
+                if key not in improving:
+                    improving[key] = asyncio.ensure_future(improve(question, context))
+                question = await improving[key]
+            if on_validated:
+                on_validated(index, question)
+            return question
+        
+        return await asyncio.gather(*(validate(i, question, context)
+                                      for i, (question, context) in enumerate(pairs)))
 
 def save_validated_questions(questions: List[Dict[str, Any]], output_file: str):
     """
@@ -157,7 +251,7 @@ def save_validated_questions(questions: List[Dict[str, Any]], output_file: str):
         for question in questions:
             f.write(f"{question['question']}\n")
             for i, option in enumerate(question['options']):
-                f.write(f"{chr(65 + i)}. {option}\n")
+                f.write(f"{LETTERS[i]}. {option}\n")
             f.write(f"ANSWER: {question['correct']}\n\n")
     
     logger.info(f"{GREEN}Saved improved questions to {output_file}{RESET}")
@@ -182,6 +276,10 @@ def main():
                       help='Size of text chunks to process (default: 8000)')
     parser.add_argument('--output', default='questions_improved.txt',
                       help='Output file for improved questions (default: questions_improved.txt)')
+    parser.add_argument('--cache-file', default='validation_cache.sqlite',
+                      help='SQLite file caching validated questions between runs (default: validation_cache.sqlite)')
+    parser.add_argument('--no-cache', action='store_true',
+                      help='Always validate questions again instead of using the cache')
     parser.add_argument('--debug', action='store_true',
                       help='Enable debug logging')
     args = parser.parse_args()
@@ -203,13 +301,8 @@ def main():
         
         try:
             extractor = PDFExtractor(args.pdf_path)
-            text_chunks = extractor.extract_text(chunk_size=args.chunk_size)
-            
-            # Combine chunks into larger ones for context
-            text = ''.join(text_chunks)
-            large_chunks = chunk_text(text, args.chunk_size)
-            logger.info(f"{GREEN}Extracted {len(text_chunks)} text chunks{RESET}")
-            logger.info(f"{GREEN}Combined into {len(large_chunks)} large chunks for validation{RESET}")
+            large_chunks = extractor.extract_text(chunk_size=args.chunk_size)
+            logger.info(f"{GREEN}Extracted {len(large_chunks)} text chunks for validation{RESET}")
         except Exception as e:
             logger.error(f"{RED}Error during PDF extraction: {str(e)}{RESET}")
             raise
@@ -218,31 +311,28 @@ def main():
         print(f"\n{BLUE}{'='*20} Improving Questions {'='*20}{RESET}")
         logger.info(f"{BLUE}Starting improvement of {len(questions)} questions...{RESET}")
 
-        validator = QuestionValidator()
-        improved_questions = []
-        
-        # Process each question with progress bar
-        for i, question in enumerate(tqdm(questions, desc="Questions processed", 
-                                        bar_format="{l_bar}%s{bar}%s{r_bar}" % (GREEN, RESET)), 1):
-            # Find most relevant chunk for this question
-            most_relevant_chunk = None
-            max_overlap = 0
-            
-            for chunk in large_chunks:
-                question_words = set(question['question'].lower().split())
-                chunk_words = set(chunk.lower().split())
-                overlap = len(question_words & chunk_words)
-                
-                if overlap > max_overlap:
-                    max_overlap = overlap
-                    most_relevant_chunk = chunk
-
-            if most_relevant_chunk:
-                improved_question = validator.validate_and_improve_question(question, most_relevant_chunk)
-                improved_questions.append(improved_question)
-            else:
+        # Find the chunk most relevant to each question. TF-IDF weighs rare words
+        # above common ones and normalizes for chunk length, so long chunks full
+        # of common words no longer win by sheer word count.
+        best_chunks = find_relevant_chunks([q['question'] for q in questions], large_chunks)
+        pairs = []
+        for i, (question, best) in enumerate(zip(questions, best_chunks), 1):
+            if best is None:
                 logger.warning(f"{YELLOW}Could not find relevant context for question {i}{RESET}")
-                improved_questions.append(question)
+                pairs.append((question, None))
+            else:
+                pairs.append((question, large_chunks[best]))
+        
+        async def improve():
+            cache_path = None if args.no_cache else args.cache_file
+            async with QuestionValidator(cache_path=cache_path) as validator:
+                return await validator.run_all(pairs, lambda i, question: progress.update(1))
+        
+        # Improve all questions concurrently, with a progress bar
+        logger.info(f"{BLUE}Sending up to {OLLAMA_NUM_PARALLEL} concurrent requests to Ollama{RESET}")
+        with tqdm(total=len(pairs), desc="Questions processed",
+                  bar_format="{l_bar}%s{bar}%s{r_bar}" % (GREEN, RESET)) as progress:
+            improved_questions = asyncio.run(improve())
 
         # Step 4: Save results
         print(f"\n{BLUE}{'='*20} Saving Results {'='*20}{RESET}")
@@ -2,15 +2,63 @@
 Module for translating questions to Italian.
 """
 from deep_translator import GoogleTranslator
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of characters Google Translate accepts in one request
+MAX_REQUEST_CHARS = 5000
+
+# Number of questions translated concurrently. Each request is a network
+# round trip, so threads mostly wait on Google rather than on the GIL.
+TRANSLATION_WORKERS = 8
+
 class QuestionTranslator:
-    def __init__(self):
-        """Initialize the translator with Italian as target language."""
-        self.translator = GoogleTranslator(source='en', target='it')
+    def __init__(self, workers: int = TRANSLATION_WORKERS):
+        """
+        Initialize the translator with Italian as target language.
+        
+        Args:
+            workers (int): Number of questions translated concurrently
+        """
+        self.workers = workers
+        self._local = threading.local()
+        
+    @property
+    def translator(self) -> GoogleTranslator:
+        """
+        Translator of the current thread. GoogleTranslator stores the text of
+        the request being sent on the instance, so threads cannot share one.
+        """
+        if not hasattr(self._local, "translator"):
+            self._local.translator = GoogleTranslator(source='en', target='it')
+        return self._local.translator
+        
+    def _translate_texts(self, texts: List[str]) -> List[str]:
+        """
+        Translate several single-line texts in one request.
+        
+        The texts are sent as the lines of a single text. If they do not fit
+        in one request, or the translation does not have one line per text,
+        each text is translated separately.
+        
+        Args:
+            texts (List[str]): Texts to translate
+            
+        Returns:
+            List[str]: Translated texts, in the same order
+        """
+        joined = '\n'.join(texts)
+        if len(joined) <= MAX_REQUEST_CHARS and not any('\n' in text for text in texts):
+            lines = self.translator.translate(joined).split('\n')
+            if len(lines) == len(texts):
+                return [line.strip() for line in lines]
+            logger.debug("Joined translation has %d lines instead of %d, translating separately",
+                         len(lines), len(texts))
+        return [self.translator.translate(text) for text in texts]
         
     def translate_question(self, question: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -23,12 +71,11 @@ class QuestionTranslator:
             Dict[str, Any]: Translated question dictionary
         """
         try:
+            # Question and options are translated in a single request
+            translated_texts = self._translate_texts([question["question"]] + list(question["options"]))
             translated = {
-                "question": self.translator.translate(question["question"]),
-                "options": [
-                    self.translator.translate(option)
-                    for option in question["options"]
-                ],
+                "question": translated_texts[0],
+                "options": translated_texts[1:],
                 "correct": question["correct"]  # Keep the same letter
             }
             return translated
@@ -41,6 +88,9 @@ class QuestionTranslator:
         """
         Translate a batch of questions to Italian.
         
+        Questions are translated concurrently; the results keep the order
+        of the input.
+        
         Args:
             questions (List[Dict[str, Any]]): List of question dictionaries
             
@@ -50,10 +100,10 @@ class QuestionTranslator:
         translated_questions = []
         total = len(questions)
         
-        for i, question in enumerate(questions):
-            if i % 10 == 0:
-                logger.info(f"Translating question {i+1}/{total}")
-            translated = self.translate_question(question)
-            translated_questions.append(translated)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for i, translated in enumerate(executor.map(self.translate_question, questions)):
+                if i % 10 == 0:
+                    logger.info(f"Translating question {i+1}/{total}")
+                translated_questions.append(translated)
             
         return translated_questions
@@ -3,11 +3,96 @@ Utility functions for the PDF Question Extractor project.
 
 This module provides helper functions for:
 - Text chunking
+- Finding the text chunk most relevant to a question
+- Trimming context to the passages relevant to a question
+- Parsing and validating questions in Aiken format
 - File I/O operations for questions
 - Data formatting
+- Sessions and caches shared by the scripts that query Ollama
 """
 
-from typing import List, Dict, Any
+import os
+import re
+import string
+import hashlib
+import sqlite3
+import aiohttp
+import numpy as np
+import requests
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Option letters by index
+LETTERS = tuple(string.ascii_uppercase)
+
+# Valid answer letters of an Aiken question
+_ANSWER_LETTERS = frozenset('ABCD')
+
+# Maximum number of concurrent requests sent to Ollama. Should match the
+# OLLAMA_NUM_PARALLEL setting of the Ollama server.
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))
+
+# Default model: LLaMA 3.2 3B with 4-bit weights. Generation speed is limited
+# by reading the weights for every token, so the tag is pinned explicitly
+# rather than relying on whatever build the plain "llama3.2" tag points to.
+DEFAULT_MODEL = "llama3.2:3b-instruct-q4_K_M"
+
+# A question in Aiken format: the question line, then four option lines in
+# any letter order and any number of ANSWER lines (the last one counts),
+# ending at a blank line or at the end of the file. Blocks with a fifth
+# option or any other extra line are skipped.
+_ANSWER_LINES = r'(?:\n[^\S\n]*ANSWER:([^:\n]*)(?::.*)?)*'
+_OPTION_LINE = r'\n[^\S\n]*[ABCD]\.(.*)'
+_AIKEN_QUESTION_RE = re.compile(
+    r'^[^\S\n]*(?![ABCD]\.|ANSWER:)(\S.*)' + _ANSWER_LINES
+    + (_OPTION_LINE + _ANSWER_LINES) * 4
+    + r'(?=\n[^\S\n]*$|\Z)',
+    re.MULTILINE
+)
+
+def stream_chunks(texts: Iterable[str], chunk_size: int = 4000) -> Iterator[str]:
+    """
+    Split a stream of texts into chunks of approximately equal size.
+    
+    The texts are treated as one concatenated text, but only the part not yet
+    emitted is kept in memory, so chunks are yielded as soon as enough text
+    has arrived.
+    
+    Args:
+        texts (Iterable[str]): Consecutive pieces of text (e.g. PDF pages)
+        chunk_size (int): Target size for each chunk
+        
+    Yields:
+        str: Text chunks
+    """
+    buffer = ''
+    for text in texts:
+        buffer += text
+        current_pos = 0
+        
+        # Split only while the rest is longer than a chunk, otherwise
+        # more text may still arrive
+        while len(buffer) - current_pos > chunk_size:
+            end = current_pos + chunk_size
+            
+            # Look for the last period within the chunk
+            split_pos = max(
+                buffer.rfind('. ', current_pos, end),
+                buffer.rfind('? ', current_pos, end),
+                buffer.rfind('! ', current_pos, end)
+            )
+            
+            if split_pos == -1:
+                # If no good splitting point found, just split at chunk_size
+                split_pos = end
+                
+            yield buffer[current_pos:split_pos + 1].strip()
+            current_pos = split_pos + 1
+            
+        buffer = buffer[current_pos:]
+        
+    if buffer:
+        yield buffer
 
 def chunk_text(text: str, chunk_size: int = 4000) -> List[str]:
     """
@@ -20,33 +105,293 @@ def chunk_text(text: str, chunk_size: int = 4000) -> List[str]:
     Returns:
         List[str]: List of text chunks
     """
-    chunks = []
-    current_pos = 0
-    text_length = len(text)
+    return list(stream_chunks([text], chunk_size))
+
+def find_relevant_chunks(queries: List[str], chunks: List[str]) -> List[Optional[int]]:
+    """
+    Find the most relevant chunk for each query using TF-IDF similarity.
+    
+    All queries are scored against all chunks with a single sparse matrix
+    product, so each chunk is tokenized only once. The score matrix stays
+    sparse, so memory grows with the number of matching terms rather than
+    with queries x chunks.
+    
+    Args:
+        queries (List[str]): Texts to find context for (e.g. question texts)
+        chunks (List[str]): Candidate text chunks
+        
+    Returns:
+        List[Optional[int]]: Index of the best chunk for each query, or None if
+                             the query shares no terms with any chunk
+    """
+    if not queries or not chunks:
+        return [None] * len(queries)
+        
+    vectorizer = TfidfVectorizer(lowercase=True)
+    chunk_matrix = vectorizer.fit_transform(chunks)
+    scores = vectorizer.transform(queries) @ chunk_matrix.T
+    
+    best = np.asarray(scores.argmax(axis=1)).ravel()
+    best_scores = scores.max(axis=1).toarray().ravel()
+    return [int(idx) if score > 0 else None for idx, score in zip(best, best_scores)]
+
+def create_session(read_timeout: Optional[float] = None) -> aiohttp.ClientSession:
+    """
+    Create an HTTP session for sending concurrent requests to Ollama.
+    
+    The session keeps one keep-alive connection per concurrent request. There
+    is no total timeout: requests may wait in the Ollama queue for a long time.
+    
+    Args:
+        read_timeout (float, optional): Seconds without any data from Ollama
+                                        after which a request fails
+        
+    Returns:
+        aiohttp.ClientSession: New session, to be closed by the caller
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=OLLAMA_NUM_PARALLEL, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=None, sock_read=read_timeout)
+    )
+
+def open_cache(path: str, ddl: str) -> sqlite3.Connection:
+    """
+    Open a SQLite cache file, creating its table if needed.
+    
+    The write-ahead log with synchronous=NORMAL keeps each commit cheap; a
+    crash may lose the last entries, which are then generated again.
+    
+    Args:
+        path (str): Path of the cache file
+        ddl (str): CREATE TABLE IF NOT EXISTS statement of the cache table
+        
+    Returns:
+        sqlite3.Connection: Open connection, to be closed by the caller
+    """
+    cache = sqlite3.connect(path)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute("PRAGMA synchronous=NORMAL")
+    cache.execute(ddl)
+    return cache
+
+def cache_key(*parts: str) -> bytes:
+    """
+    Build a cache key from everything a cached result depends on.
+    
+    Parts are separated by a NUL byte, so ("ab", "c") and ("a", "bc") give
+    different keys.
+    
+    Args:
+        *parts (str): Values the cached result depends on
+        
+    Returns:
+        bytes: 16-byte BLAKE2b digest
+    """
+    key = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        key.update(part.encode('utf-8'))
+        key.update(b'\0')
+    return key.digest()
+
+def embed_texts(texts: List[str], model: str, base_url: str = "http://localhost:11434",
+                cache_path: Optional[str] = None, batch_size: int = 32) -> np.ndarray:
+    """
+    Embed texts with an Ollama embedding model.
+    
+    Texts are sent in batches to the /api/embed endpoint. With a cache file,
+    embeddings are stored in SQLite by hash of model and text, so each text
+    is only embedded once across runs.
+    
+    Args:
+        texts (List[str]): Texts to embed
+        model (str): Name of the Ollama embedding model (e.g. nomic-embed-text)
+        base_url (str): Base URL for the Ollama API
+        cache_path (str, optional): SQLite file caching embeddings
+        batch_size (int): Number of texts per request
+        
+    Returns:
+        np.ndarray: One L2-normalized embedding per row
+    """
+    keys = [cache_key(model, text) for text in texts]
+    vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+    
+    cache = open_cache(cache_path, "CREATE TABLE IF NOT EXISTS embedding (key BLOB PRIMARY KEY, vector BLOB)") if cache_path else None
+    try:
+        if cache:
+            for i, key in enumerate(keys):
+                row = cache.execute("SELECT vector FROM embedding WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vectors[i] = np.frombuffer(row[0], dtype=np.float32)
+        
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        with requests.Session() as session:
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                response = session.post(f"{base_url}/api/embed",
+                                        json={"model": model, "input": [texts[i] for i in batch]})
+                response.raise_for_status()
+                for i, embedding in zip(batch, response.json()['embeddings']):
+                    vectors[i] = np.asarray(embedding, dtype=np.float32)
+                    if cache:
+                        cache.execute("INSERT OR REPLACE INTO embedding VALUES (?, ?)", (keys[i], vectors[i].tobytes()))
+                if cache:
+                    cache.commit()
+    finally:
+        if cache:
+            cache.close()
+    
+    matrix = np.vstack(vectors)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+def find_relevant_chunks_semantic(queries: List[str], chunks: List[str], model: str,
+                                  base_url: str = "http://localhost:11434",
+                                  cache_path: Optional[str] = None) -> List[Optional[int]]:
+    """
+    Find the most relevant chunk for each query by embedding similarity.
+    
+    Unlike find_relevant_chunks(), this also matches queries phrased with
+    different words than the chunk, at the cost of embedding every chunk
+    once with an Ollama embedding model.
+    
+    Args:
+        queries (List[str]): Texts to find context for (e.g. question texts)
+        chunks (List[str]): Candidate text chunks
+        model (str): Name of the Ollama embedding model (e.g. nomic-embed-text)
+        base_url (str): Base URL for the Ollama API
+        cache_path (str, optional): SQLite file caching embeddings
+        
+    Returns:
+        List[Optional[int]]: Index of the best chunk for each query, or None
+                             if there are no chunks
+    """
+    if not queries or not chunks:
+        return [None] * len(queries)
+        
+    chunk_vectors = embed_texts(chunks, model, base_url, cache_path)
+    query_vectors = embed_texts(queries, model, base_url, cache_path)
+    
+    # Cosine similarity, since all vectors are normalized
+    return [int(idx) for idx in (query_vectors @ chunk_vectors.T).argmax(axis=1)]
 
-    while current_pos < text_length:
-        if current_pos + chunk_size >= text_length:
-            chunks.append(text[current_pos:])
-            break
+def trim_context(query: str, context: str, max_chars: int = 3200, passage_size: int = 400) -> str:
+    """
+    Keep only the passages of a context most relevant to a query.
+    
+    The context is split into short passages at sentence boundaries, scored
+    against the query with TF-IDF, and the best passages are kept, in their
+    original order, until max_chars is reached. Contexts already within the
+    budget are returned unchanged.
+    
+    Args:
+        query (str): Text the context should be relevant to (e.g. question texts)
+        context (str): Context to trim
+        max_chars (int): Maximum length of the trimmed context
+        passage_size (int): Target size of each passage
+        
+    Returns:
+        str: Trimmed context
+    """
+    if len(context) <= max_chars:
+        return context
+        
+    passages = chunk_text(context, passage_size)
+    vectorizer = TfidfVectorizer(lowercase=True)
+    try:
+        passage_matrix = vectorizer.fit_transform(passages)
+    except ValueError:
+        # No words at all in the context
+        return context[:max_chars]
+    scores = (vectorizer.transform([query]) @ passage_matrix.T).toarray().ravel()
+    
+    # Best passages first; ties keep their original order
+    selected = []
+    length = 0
+    for idx in np.argsort(-scores, kind='stable'):
+        if length + len(passages[idx]) > max_chars:
+            continue
+        selected.append(idx)
+        length += len(passages[idx]) + 1
+        
+    return ' '.join(passages[idx] for idx in sorted(selected))
+
+def iter_aiken_questions(response: str) -> Iterator[Dict[str, Any]]:
+    """
+    Parse questions in Aiken format from model output.
+    
+    The response is read line by line in a single pass, and each question
+    is yielded as soon as its answer line (or the next question) is read.
+    Lines that are neither options nor answers start a new question, so
+    any text the model writes before a question is skipped.
+    
+    Args:
+        response (str): Raw response from the model
+        
+    Yields:
+        Dict[str, Any]: Parsed question, with 'correct' set to None if the
+                        response has no answer line for it
+    """
+    current_question = None
+    current_options = []
+    
+    for line in response.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+            
+        # Parse options
+        if line.startswith(('A.', 'B.', 'C.', 'D.')):
+            current_options.append(line[2:].strip())
+            
+        # Parse answer
+        elif line.startswith('ANSWER:'):
+            if current_question and current_options:
+                yield {
+                    'question': current_question,
+                    'options': current_options,
+                    'correct': line[7:].strip()
+                }
+            current_question = None
+            current_options = []
             
-        # Try to find a good splitting point
-        end = min(current_pos + chunk_size, text_length)
-        
-        # Look for the last period within the chunk
-        split_pos = max(
-            text.rfind('. ', current_pos, end),
-            text.rfind('? ', current_pos, end),
-            text.rfind('! ', current_pos, end)
-        )
-        
-        if split_pos == -1:
-            # If no good splitting point found, just split at chunk_size
-            split_pos = end
+        # Any other line starts a new question
+        else:
+            if current_question and current_options:
+                yield {
+                    'question': current_question,
+                    'options': current_options,
+                    'correct': None
+                }
+            current_question = line
+            current_options = []
             
-        chunks.append(text[current_pos:split_pos + 1].strip())
-        current_pos = split_pos + 1
+    # Yield last question if exists
+    if current_question and current_options:
+        yield {
+            'question': current_question,
+            'options': current_options,
+            'correct': None
+        }
+
+def validate_aiken_format(question: Dict[str, Any]) -> bool:
+    """
+    Check that a question is complete and valid in Aiken format.
+    
+    Args:
+        question (Dict[str, Any]): Question dictionary with 'question',
+                                   'options', and 'correct' fields
+        
+    Returns:
+        bool: True if the question has a text, exactly 4 non-empty options
+              and a correct answer letter between A and D
+    """
+    if not question.get('question'):
+        return False
         
-    return chunks
+    options = question.get('options') or []
+    if len(options) != 4 or not all(options):
+        return False
+        
+    return question.get('correct') in _ANSWER_LETTERS
 
 def save_questions(questions: List[Dict[str, Any]], output_file: str):
     """
@@ -63,7 +408,7 @@ def save_questions(questions: List[Dict[str, Any]], output_file: str):
             
             # Write options
             for i, option in enumerate(question['options']):
-                f.write(f"{chr(65 + i)}. {option}\n")
+                f.write(f"{LETTERS[i]}. {option}\n")
                 
             # Write correct answer
             f.write(f"ANSWER: {question['correct']}\n\n")
@@ -72,46 +417,27 @@ def load_questions(file_path: str) -> List[Dict[str, Any]]:
     """
     Load questions from a file in Aiken format.
     
+    The whole file is matched with a single regular expression, so no
+    Python code runs per line. Blocks that are not a question followed by
+    exactly four options are skipped.
+    
     Args:
         file_path (str): Path to questions file
         
     Returns:
         List[Dict[str, Any]]: List of question dictionaries
     """
-    questions = []
-    current_question = None
-    
     with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if not line:
-            if current_question and len(current_question['options']) == 4:
-                questions.append(current_question)
-            current_question = None
-            i += 1
-            continue
-            
-        if not line.startswith(('A.', 'B.', 'C.', 'D.', 'ANSWER:')):
-            # This is a question
-            current_question = {
-                'question': line,
-                'options': [],
-                'correct': None
-            }
-        elif line.startswith('ANSWER:'):
-            if current_question:
-                current_question['correct'] = line.split(':')[1].strip()
-        elif current_question and line[0] in 'ABCD' and line[1] == '.':
-            current_question['options'].append(line[2:].strip())
-            
-        i += 1
-        
-    # Add the last question if it exists
-    if current_question and len(current_question['options']) == 4:
-        questions.append(current_question)
+        text = f.read()
         
+    questions = []
+    for match in _AIKEN_QUESTION_RE.finditer(text):
+        groups = match.groups()
+        # Groups alternate answer lines and options after the question line
+        answers = [answer for answer in groups[1::2] if answer is not None]
+        questions.append({
+            'question': groups[0].strip(),
+            'options': [option.strip() for option in groups[2::2]],
+            'correct': answers[-1].strip() if answers else None
+        })
     return questions